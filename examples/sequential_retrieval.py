@@ -12,16 +12,25 @@ Let's begin by importing all the necessary libraries, and setting the
 random seed for reproducibility.
 """
 
-import collections
+import concurrent.futures
 import os
-import random
 
 import keras
+import numpy as np
 import pandas as pd
 import tensorflow as tf  # Needed only for the dataset
 
 import keras_rs
 
+"""
+We use mixed precision: the weights are kept in `float32`, but the GRU and the
+embedding products used for training are computed in `bfloat16`, which is
+faster and uses less memory on modern GPUs and TPUs. The retrieval of the top
+movies at prediction time stays in `float32`.
+"""
+
+keras.config.set_dtype_policy("mixed_bfloat16")
+
 """
 Let's also define all important variables/hyperparameters below.
 """
@@ -89,30 +98,54 @@ movielens_extracted_dir = os.path.join(
 
 
 # Read the dataset.
-def read_data(data_directory, min_rating=None):
-    """Read movielens ratings.dat and movies.dat file
-    into dataframe.
-    """
+def read_ratings(data_directory, min_rating=None):
+    """Read movielens ratings.dat file into dataframe."""
 
+    # Multi-character separators like `::` require the slow Python parser.
+    # Since ratings are purely numeric, we instead split on `:` with the fast
+    # C parser and only keep every other column, skipping the empty ones.
     ratings_df = pd.read_csv(
         os.path.join(data_directory, RATINGS_FILE_NAME),
-        sep="::",
-        names=RATINGS_DATA_COLUMNS,
-        encoding="unicode_escape",
+        sep=":",
+        header=None,
+        usecols=[0, 2, 4, 6],
+        engine="c",
     )
-    ratings_df["Timestamp"] = ratings_df["Timestamp"].apply(int)
+    ratings_df.columns = RATINGS_DATA_COLUMNS
 
     # Remove movies with `rating < min_rating`.
     if min_rating is not None:
         ratings_df = ratings_df[ratings_df["Rating"] >= min_rating]
+    return ratings_df
+
+
+def read_movies(data_directory):
+    """Read movielens movies.dat file into dataframe."""
 
-    movies_df = pd.read_csv(
+    return pd.read_csv(
         os.path.join(data_directory, MOVIES_FILE_NAME),
         sep="::",
         names=MOVIES_DATA_COLUMNS,
         encoding="unicode_escape",
+        # Titles can contain `:`, so the Python parser is needed here. This
+        # file is small.
+        engine="python",
     )
-    return ratings_df, movies_df
+
+
+def read_data(data_directory, min_rating=None):
+    """Read movielens ratings.dat and movies.dat file
+    into dataframe.
+
+    The two files are independent, so they are read concurrently.
+    """
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        ratings_future = executor.submit(
+            read_ratings, data_directory, min_rating
+        )
+        movies_future = executor.submit(read_movies, data_directory)
+        return ratings_future.result(), movies_future.result()
 
 
 ratings_df, movies_df = read_data(
@@ -135,24 +168,28 @@ for every user. Here is the function for doing just that.
 
 
 def get_movie_sequence_per_user(ratings_df):
-    """Get movieID sequences for every user."""
-    sequences = collections.defaultdict(list)
-
-    for user_id, movie_id, rating, timestamp in ratings_df.values:
-        sequences[user_id].append(
-            {
-                "movie_id": movie_id,
-                "timestamp": timestamp,
-                "rating": rating,
-            }
-        )
+    """Get movieID sequences for every user.
 
-    # Sort movie sequences by timestamp for every user.
-    for user_id, context in sequences.items():
-        context.sort(key=lambda x: x["timestamp"])
-        sequences[user_id] = context
+    Rather than building a list of movies per user, we sort all ratings by
+    user and timestamp once and keep the columns as contiguous arrays. The
+    sequence of user `i` is then the slice `indptr[i]:indptr[i + 1]` of every
+    array.
+    """
+    ratings_df = ratings_df.sort_values(
+        ["UserID", "Timestamp"], kind="mergesort"
+    )
+
+    _, first_index = np.unique(ratings_df["UserID"].values, return_index=True)
+    indptr = np.append(first_index, len(ratings_df))
 
-    return sequences
+    sequences = {
+        # Movie IDs fit in 32 bits, which halves the size of the examples and
+        # of the embedding lookups compared to the default 64-bit integers.
+        "movie_id": ratings_df["MovieID"].values.astype("int32"),
+        "timestamp": ratings_df["Timestamp"].values,
+        "rating": ratings_df["Rating"].values,
+    }
+    return sequences, indptr
 
 
 """
@@ -171,98 +208,90 @@ with training the model:
 """
 
 
-def generate_examples_from_user_sequences(sequences):
-    """Generates sequences for all users, with padding, truncation, etc."""
-
-    def generate_examples_from_user_sequence(sequence):
-        """Generates examples for a single user sequence."""
-
-        examples = []
-        for label_idx in range(1, len(sequence)):
-            start_idx = max(0, label_idx - MAX_CONTEXT_LENGTH)
-            context = sequence[start_idx:label_idx]
-
-            # Padding
-            while len(context) < MAX_CONTEXT_LENGTH:
-                context.append(
-                    {
-                        "movie_id": 0,
-                        "timestamp": 0,
-                        "rating": 0.0,
-                    }
-                )
-
-            label_movie_id = int(sequence[label_idx]["movie_id"])
-            context_movie_id = [int(movie["movie_id"]) for movie in context]
+def generate_examples_from_user_sequences(sequences, indptr):
+    """Generates sequences for all users, with padding, truncation, etc.
 
-            examples.append(
-                {
-                    "context_movie_id": context_movie_id,
-                    "label_movie_id": label_movie_id,
-                },
-            )
-        return examples
-
-    all_examples = []
-    for sequence in sequences.values():
-        if len(sequence) < MIN_SEQUENCE_LENGTH:
-            continue
-
-        user_examples = generate_examples_from_user_sequence(sequence)
-
-        all_examples.extend(user_examples)
+    Instead of looping over users and labels in Python, we compute the
+    position of every label in the flat `movie_id` array and gather all the
+    contexts at once into a single `(num_examples, MAX_CONTEXT_LENGTH)` array.
+    """
+    movie_ids = sequences["movie_id"]
+    user_lengths = np.diff(indptr)
+    position_user_starts = np.repeat(indptr[:-1], user_lengths)
+
+    # Every movie but the first one of a user is a label. Users with fewer
+    # than `MIN_SEQUENCE_LENGTH` movies are dropped.
+    is_label = np.repeat(user_lengths >= MIN_SEQUENCE_LENGTH, user_lengths)
+    is_label[indptr[:-1]] = False
+    label_positions = np.flatnonzero(is_label)
+    label_user_starts = position_user_starts[label_positions]
+
+    # The context is made of up to `MAX_CONTEXT_LENGTH` movies preceding the
+    # label, padded with zeros on the right.
+    context_starts = np.maximum(
+        label_user_starts, label_positions - MAX_CONTEXT_LENGTH
+    )
+    context_positions = context_starts[:, None] + np.arange(MAX_CONTEXT_LENGTH)
+    is_padding = context_positions >= label_positions[:, None]
+    context_movie_id = np.where(
+        is_padding,
+        np.int32(0),
+        movie_ids[np.minimum(context_positions, label_positions[:, None] - 1)],
+    )
+    label_movie_id = movie_ids[label_positions]
 
-    return all_examples
+    return context_movie_id, label_movie_id
 
 
 """
-Let's split the dataset into train and test sets. Also, we need to
-change the format of the dataset dictionary so as to enable conversion
-to a `tf.data.Dataset` object. 
+Let's split the dataset into train and test sets. Since the examples are
+already stored as one array of contexts and one array of labels, we shuffle
+and split both arrays with the same permutation.
 """
-sequences = get_movie_sequence_per_user(ratings_df)
-examples = generate_examples_from_user_sequences(sequences)
-
-# Train-test split.
-random.shuffle(examples)
-split_index = int(TRAIN_DATA_FRACTION * len(examples))
-train_examples = examples[:split_index]
-test_examples = examples[split_index:]
-
-
-def list_of_dicts_to_dict_of_lists(list_of_dicts):
-    """Convert list of dictionaries to dictionary of lists for
-    `tf.data` conversion.
-    """
-    dict_of_lists = collections.defaultdict(list)
-    for dictionary in list_of_dicts:
-        for key, value in dictionary.items():
-            dict_of_lists[key].append(value)
-    return dict_of_lists
-
+sequences, indptr = get_movie_sequence_per_user(ratings_df)
+context_movie_id, label_movie_id = generate_examples_from_user_sequences(
+    sequences, indptr
+)
 
-train_examples = list_of_dicts_to_dict_of_lists(train_examples)
-test_examples = list_of_dicts_to_dict_of_lists(test_examples)
+# Train-test split. Shuffling is a single vectorized gather on the arrays.
+permutation = np.random.default_rng(42).permutation(len(label_movie_id))
+split_index = int(TRAIN_DATA_FRACTION * len(label_movie_id))
+train_indices = permutation[:split_index]
+test_indices = permutation[split_index:]
 
-train_ds = tf.data.Dataset.from_tensor_slices(train_examples).map(
-    lambda x: (x["context_movie_id"], x["label_movie_id"])
+# `tf.data` slices the tuple directly into `(context, label)` pairs, so there
+# is no need for a `map()` to unpack the examples.
+train_ds = tf.data.Dataset.from_tensor_slices(
+    (context_movie_id[train_indices], label_movie_id[train_indices])
 )
-test_ds = tf.data.Dataset.from_tensor_slices(test_examples).map(
-    lambda x: (x["context_movie_id"], x["label_movie_id"])
+test_ds = tf.data.Dataset.from_tensor_slices(
+    (context_movie_id[test_indices], label_movie_id[test_indices])
 )
 
 """
-We need to batch our datasets. We also user `cache()` and `prefetch()`
-for better performance.
+We need to batch our datasets. We also use `cache()` and `prefetch()`
+for better performance. The training set is cached before being shuffled and
+batched so that every epoch sees different batches, and therefore different
+in-batch negatives. Dropping the last incomplete batch keeps the batch
+dimension static, which avoids recompiling the model for a different shape.
 """
-train_ds = train_ds.batch(BATCH_SIZE).cache().prefetch(tf.data.AUTOTUNE)
-test_ds = test_ds.batch(TEST_BATCH_SIZE).cache().prefetch(tf.data.AUTOTUNE)
+train_ds = (
+    train_ds.cache()
+    .shuffle(len(train_indices), reshuffle_each_iteration=True)
+    .batch(BATCH_SIZE, drop_remainder=True)
+    .prefetch(tf.data.AUTOTUNE)
+)
+test_ds = (
+    test_ds.cache()
+    .batch(TEST_BATCH_SIZE, drop_remainder=True)
+    .prefetch(tf.data.AUTOTUNE)
+)
 
 """
 Let's print out one batch.
 """
 
-for sample in train_ds.take(1):
+for sample in train_ds.take(1).as_numpy_iterator():
     print(sample)
 
 """
@@ -275,10 +304,11 @@ we use the query tower with a Gated Recurrent Unit (GRU) layer
 to encode the sequence of historical movies, and keep the same
 candidate tower for the candidate movie.
 
-Note: Take a look at how the labels are defined. The label tensor
-(of shape `(batch_size, batch_size)`) contains one-hot vectors. The idea
+Note: Take a look at how the labels are defined. The label of the `i`-th
+sample is simply `i`, the index of its own movie in the batch. The idea
 is: for every sample, consider movie IDs corresponding to other samples in
-the batch as negatives.
+the batch as negatives. Using sparse labels avoids materializing a
+`(batch_size, batch_size)` matrix of one-hot vectors at every step.
 """
 
 
@@ -298,10 +328,14 @@ class SequentialRetrievalModel(keras.Model):
     ):
         super().__init__(**kwargs)
         # Our query tower, simply an embedding table followed by
-        # a GRU unit. This encodes sequence of historical movies.
+        # a GRU unit. This encodes sequence of historical movies. Movie ID 0
+        # is only used for padding, so we mask it out to make the GRU skip
+        # the padded steps.
         self.query_model = keras.Sequential(
             [
-                keras.layers.Embedding(movies_count + 1, embedding_dimension),
+                keras.layers.Embedding(
+                    movies_count + 1, embedding_dimension, mask_zero=True
+                ),
                 keras.layers.GRU(embedding_dimension),
             ]
         )
@@ -311,11 +345,12 @@ class SequentialRetrievalModel(keras.Model):
             movies_count + 1, embedding_dimension
         )
 
-        # The layer that performs the retrieval.
+        # The layer that performs the retrieval. It runs in full precision so
+        # that the top movies are ranked from `float32` scores.
         self.retrieval = keras_rs.layers.BruteForceRetrieval(
-            k=10, return_scores=False
+            k=10, return_scores=False, dtype="float32"
         )
-        self.loss_fn = keras.losses.CategoricalCrossentropy(
+        self.loss_fn = keras.losses.SparseCategoricalCrossentropy(
             from_logits=True,
         )
 
@@ -347,15 +382,17 @@ class SequentialRetrievalModel(keras.Model):
         candidate_embeddings = self.candidate_model(candidate_id)
 
         num_queries = keras.ops.shape(query_embeddings)[0]
-        num_candidates = keras.ops.shape(candidate_embeddings)[0]
 
-        # One-hot vectors for labels.
-        labels = keras.ops.eye(num_queries, num_candidates)
+        # The positive candidate of the `i`-th query is the `i`-th candidate.
+        labels = keras.ops.arange(num_queries, dtype="int32")
 
-        # Compute the affinity score by multiplying the two embeddings.
-        scores = keras.ops.matmul(
-            query_embeddings, keras.ops.transpose(candidate_embeddings)
+        # Compute the affinity score by multiplying the two embeddings. Using
+        # `einsum` lets the backend fold the transpose into the product.
+        scores = keras.ops.einsum(
+            "bd,cd->bc", query_embeddings, candidate_embeddings
         )
+        # Compute the softmax in full precision.
+        scores = keras.ops.cast(scores, "float32")
 
         return self.loss_fn(labels, scores, sample_weight)
 
@@ -384,30 +421,40 @@ model.fit(
 Now that we have a model, we would like to be able to make predictions.
 
 So far, we have only handled movies by id. Now is the time to create a mapping
-keyed by movie IDs to be able to surface the titles.
+keyed by movie IDs to be able to surface the titles. Since movie IDs are small
+integers, we use an array indexed by movie ID, which lets us look up the titles
+of a whole sequence of movies at once.
 """
 
-movie_id_to_movie_title = dict(zip(movies_df["MovieID"], movies_df["Title"]))
-movie_id_to_movie_title[0] = ""  # Because id 0 is not in the dataset.
+# The array covers every ID the model can retrieve. IDs that are not in the
+# dataset, like 0 which is used for padding, map to "".
+movie_id_to_movie_title = np.full(
+    model.candidate_model.input_dim, "", dtype=object
+)
+movie_id_to_movie_title[movies_df["MovieID"].values] = movies_df["Title"].values
 
 """
 We then simply use the Keras `model.predict()` method. Under the hood, it calls
 the `BruteForceRetrieval` layer to perform the actual retrieval.
 
+Brute-force retrieval scores every movie for every query, which is perfectly
+fine for the few thousand movies of MovieLens. For catalogs with millions of
+candidates, an approximate nearest neighbour index is much faster. Take a look
+at the [ScANN](https://github.com/keras-team/keras-rs/blob/main/examples/scann.py)
+example to see how to build such an index from the candidate embeddings once
+the model is trained.
+
 Note that this model can retrieve movies already watched by the user. We could
 easily add logic to remove them if that is desirable.
 """
 
 print("\n==> Movies the user has watched:")
 movie_sequence = test_ds.unbatch().take(1)
-for element in movie_sequence:
-    for movie_id in element[0][:-1]:
-        print(movie_id_to_movie_title[movie_id.numpy()], end=", ")
-    print(movie_id_to_movie_title[element[0][-1].numpy()])
+for context_movie_ids, _ in movie_sequence.as_numpy_iterator():
+    print(", ".join(movie_id_to_movie_title[context_movie_ids]))
 
 predictions = model.predict(movie_sequence.batch(1))
 predictions = keras.ops.convert_to_numpy(predictions["predictions"])
 
 print("\n==> Recommended movies for the above sequence:")
-for movie_id in predictions[0]:
-    print(movie_id_to_movie_title[movie_id])
+print("\n".join(movie_id_to_movie_title[predictions[0]]))
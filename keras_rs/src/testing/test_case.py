@@ -9,6 +9,14 @@ import numpy as np
 from keras_rs.src import types
 
 
+def _convert_to_numpy(x: types.Tensor) -> np.ndarray:
+    """Converts a tensor to a NumPy array without copying NumPy arrays."""
+    if isinstance(x, np.ndarray):
+        return x
+    converted: np.ndarray = keras.ops.convert_to_numpy(x)
+    return converted
+
+
 class TestCase(unittest.TestCase):
     """TestCase class for all Keras Recommenders tests."""
 
@@ -34,10 +42,21 @@ class TestCase(unittest.TestCase):
           rtol: Relative tolerance.
           msg: Optional error message.
         """
-        if not isinstance(actual, np.ndarray):
-            actual = keras.ops.convert_to_numpy(actual)
-        if not isinstance(desired, np.ndarray):
-            desired = keras.ops.convert_to_numpy(desired)
+        actual = _convert_to_numpy(actual)
+        desired = _convert_to_numpy(desired)
+        # Fast path for the common case where floating point values are close.
+        # Other dtypes, and values that are not close, go through
+        # `np.testing.assert_allclose`, which handles integer overflow, NaNs
+        # and infinities, and gives a detailed error.
+        if actual.shape == desired.shape and np.issubdtype(
+            np.result_type(actual, desired), np.floating
+        ):
+            with np.errstate(invalid="ignore", over="ignore"):
+                is_close = np.abs(actual - desired) <= atol + rtol * np.abs(
+                    desired
+                )
+                if np.all(is_close & np.isfinite(desired)):
+                    return
         np.testing.assert_allclose(
             actual, desired, atol=atol, rtol=rtol, err_msg=msg
         )
@@ -52,10 +71,8 @@ class TestCase(unittest.TestCase):
           desired: Expected tensor, the second tensor to compare.
           msg: Optional error message.
         """
-        if not isinstance(actual, np.ndarray):
-            actual = keras.ops.convert_to_numpy(actual)
-        if not isinstance(desired, np.ndarray):
-            desired = keras.ops.convert_to_numpy(desired)
+        actual = _convert_to_numpy(actual)
+        desired = _convert_to_numpy(desired)
         np.testing.assert_array_equal(actual, desired, err_msg=msg)
 
     def run_model_saving_test(
@@ -0,0 +1,39 @@
+import numpy as np
+from absl.testing import parameterized
+
+from keras_rs.src import testing
+
+
+class TestCaseTest(testing.TestCase, parameterized.TestCase):
+    @parameterized.named_parameters(
+        ("float", np.array([1.0, 2.0]), np.array([1.0, 2.0 + 1e-7])),
+        ("bool", np.array([True, False]), np.array([True, False])),
+        ("uint8", np.array([3], dtype="uint8"), np.array([3], dtype="uint8")),
+        ("inf", np.array([np.inf, -np.inf]), np.array([np.inf, -np.inf])),
+        ("nan", np.array([np.nan, 1.0]), np.array([np.nan, 1.0])),
+    )
+    def test_assert_all_close_passes(self, actual, desired):
+        self.assertAllClose(actual, desired)
+
+    @parameterized.named_parameters(
+        ("float", np.array([1.0, 2.0]), np.array([1.0, 2.1]), 1e-6),
+        ("bool", np.array([True, False]), np.array([True, True]), 1e-6),
+        (
+            "uint8_wrap_around",
+            np.array([0], dtype="uint8"),
+            np.array([255], dtype="uint8"),
+            1,
+        ),
+        (
+            "int64_overflow",
+            np.array([2**62], dtype="int64"),
+            np.array([-(2**62)], dtype="int64"),
+            1,
+        ),
+        ("inf", np.array([np.inf]), np.array([-np.inf]), 1e-6),
+        ("nan", np.array([np.nan]), np.array([1.0]), 1e-6),
+        ("shape", np.array([1.0, 1.0]), np.array([1.0]), 1e-6),
+    )
+    def test_assert_all_close_fails(self, actual, desired, atol):
+        with self.assertRaises(AssertionError):
+            self.assertAllClose(actual, desired, atol=atol)